@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+import copy
+from functools import lru_cache
+from types import MappingProxyType
+
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 import streamlit as st
 
 # --------------------------------------------------------------------
@@ -21,130 +24,241 @@ VAL = {
     "Na": 1, "Ca": 2, "Mg": 2, "Fe": 2,
     "Cl": 1, "HCO3": 1, "SO4": 2, "CO3": 2,
 }
-FACTOR = {ion: VAL[ion]/MW[ion] for ion in MW}   # mg/L -> meq/L
+# mg/L -> meq/L, congelado: se construye una sola vez al importar y nadie
+# puede mutarlo por accidente
+FACTOR = MappingProxyType({ion: VAL[ion]/MW[ion] for ion in MW})
+
+# Versión array de FACTOR: lookup por código categórico en vez de dict por fila
+IONS = np.array(list(MW))
+FACTOR_ARR = np.array([FACTOR[i] for i in IONS], dtype=np.float64)
 
 # --------------------------------------------------------------------
+@st.cache_data(show_spinner=False)
 def normalize(df_edit: pd.DataFrame, unit: str) -> pd.DataFrame:
     """Devuelve DataFrame con columnas: Ion, Group, meqL (normalizada)."""
-    df = df_edit.copy()
-    df.columns = [c.strip().title() if c.lower()=="group" else c for c in df.columns]
-    # Normalizo nombres de columnas esperadas
+    # Columnas esperadas (sin distinguir mayúsculas):
     # Ion, Group, Conc (si viene mg/L) o meqL (si ya viene en meq)
-    lower = {c.lower(): c for c in df.columns}
+    lower = {c.lower(): c for c in df_edit.columns}
     if "ion" not in lower:
         raise ValueError("Falta columna 'Ion'")
     if "group" not in lower:
         raise ValueError("Falta columna 'Group'")
 
+    ion = df_edit[lower["ion"]]
+    codes = pd.Categorical(ion, categories=IONS).codes
+    valid = codes >= 0   # iones soportados
+
     if unit == "mg/L":
         if "conc" not in lower:
             raise ValueError("Con unit='mg/L' se espera columna 'Conc'")
-        df["meqL"] = df["Conc"]
-        # convierte por ion (si no está en la tabla, deja NaN)
-        df["meqL"] = df.apply(
-            lambda r: r["Conc"]*FACTOR.get(r["Ion"], np.nan), axis=1
-        )
+        # convierte por ion en una sola pasada vectorizada: gather sobre
+        # FACTOR_ARR por código categórico (ion fuera de la tabla -> NaN)
+        conc = df_edit[lower["conc"]].to_numpy(dtype=np.float64)
+        meq = np.where(valid, conc * FACTOR_ARR[np.where(valid, codes, 0)], np.nan)
     else:  # unit == "meq/L"
-        if "meqL" not in lower:
+        if "meql" not in lower:
             raise ValueError("Con unit='meq/L' se espera columna 'meqL'")
         # nada que hacer, solo aseguro tipo numérico
-        df["meqL"] = pd.to_numeric(df["meqL"], errors="coerce")
+        meq = pd.to_numeric(df_edit[lower["meql"]], errors="coerce").to_numpy(dtype=np.float64)
 
-    # Filtra solo iones soportados y limpia
-    df = df[df["Ion"].isin(MW.keys())].copy()
-    df["Group"] = df["Group"].str.strip().str.lower()
-    return df[["Ion", "Group", "meqL"]]
+    # Filtra solo iones soportados y arma la salida en una sola construcción,
+    # sin copy() del frame de entrada. La distancia log al centro se calcula
+    # aquí, en la misma pasada, para que stiff_plot no la repita.
+    group = df_edit[lower["group"]].str.strip().str.lower()
+    meq_v = meq[valid]
+    pos_v = meq_v > 0   # máscara calculada una sola vez, la reusa stiff_plot
+    return pd.DataFrame({
+        "Ion":   ion.to_numpy()[valid],
+        "Group": group.to_numpy()[valid],
+        "meqL":  meq_v,
+        "dist":  _log_dist(meq_v, pos_v),   # |log10(meq)+1|
+        "pos":   pos_v,
+    })
 
 # --------------------------------------------------------------------
 CAT_ORDER = ["Na","Ca","Mg","Fe"]
 ANI_ORDER = ["Cl","HCO3","SO4","CO3"]
 
-def stiff_plot(df: pd.DataFrame, title: str) -> go.Figure:
-    # --- separar y ordenar ---
-    cat = df[(df["Group"]=="cation") & (df["Ion"].isin(CAT_ORDER))].copy()
-    ani = df[(df["Group"]=="anion")  & (df["Ion"].isin(ANI_ORDER))].copy()
-    cat["Ion"] = pd.Categorical(cat["Ion"], categories=CAT_ORDER, ordered=True)
-    ani["Ion"] = pd.Categorical(ani["Ion"], categories=ANI_ORDER, ordered=True)
-    cat, ani = cat.sort_values("Ion"), ani.sort_values("Ion")
-
-    # --- posiciones Y fijas ---
-    y_left  = {"Na":8, "Ca":7, "Mg":6, "Fe":5}
-    y_right = {"Cl":8, "HCO3":7, "SO4":6, "CO3":5}
-    y_cat = np.array([y_left[i]  for i in cat["Ion"]], dtype=float)
-    y_ani = np.array([y_right[i] for i in ani["Ion"]], dtype=float)
-
-    # ---- X = ±|log10(meq) + 1| (centro 0, 0.1 meq/L pegado al centro) ----
-    meq_cat = cat["meqL"].to_numpy()
-    meq_ani = ani["meqL"].to_numpy()
-    dist_cat = np.where(meq_cat > 0, np.abs(np.log10(meq_cat) + 1.0), 0.0)
-    dist_ani = np.where(meq_ani > 0, np.abs(np.log10(meq_ani) + 1.0), 0.0)
-    x_cat = -dist_cat
-    x_ani =  dist_ani
-
-    # ---- rango dinámico en décadas coherente con esta escala ----
-    meq_all = pd.concat([cat["meqL"], ani["meqL"]], ignore_index=True)
-    meq_pos = meq_all[meq_all > 0]
-    max_dec = int(np.ceil(np.nanmax(np.abs(np.log10(meq_pos) + 1.0)))) if not meq_pos.empty else 1
+# --- partes estáticas del layout: solo dependen de los órdenes fijos de
+# iones, así que se construyen una vez al importar, no en cada replot ---
+_Y_LEFT  = {"Na":8, "Ca":7, "Mg":6, "Fe":5}
+_Y_RIGHT = {"Cl":8, "HCO3":7, "SO4":6, "CO3":5}
+_Y_TICKS = [8,7,6,5]
+_LEFT_LABELS = CAT_ORDER
+_RIGHT_ANNOS = [
+    dict(xref="paper", yref="y", x=0.985, y=float(_Y_RIGHT[i]), text=i,
+         showarrow=False, xanchor="right", font=dict(size=12)) for i in ANI_ORDER
+]
+_SIDE_TITLES = [
+    dict(xref="paper", yref="y", x=0.02,  y=6.5, text="<b>Cationes</b>",
+         showarrow=False, xanchor="left",  font=dict(size=14)),
+    dict(xref="paper", yref="y", x=0.985, y=6.5, text="<b>Aniones</b>",
+         showarrow=False, xanchor="right", font=dict(size=14)),
+]
+_ANNOTATIONS = _RIGHT_ANNOS + _SIDE_TITLES
 
+@lru_cache(maxsize=None)
+def _tick_arrays(max_dec: int):
+    """tickvals/ticktext para ±max_dec décadas (memoizado por max_dec)."""
     tickvals = list(range(-max_dec, max_dec + 1))      # ... -2 -1 0 1 2 ...
     # v = 0 -> "0"; v != 0 -> 10**(|v|-1)   (1, 10, 100...; 0.1 queda pegado al centro)
     ticktext = [("0" if v == 0 else f"{10**(abs(v)-1):g}") for v in tickvals]
+    return tickvals, ticktext
+
+# Línea central del diagrama: shape estático en el layout, sin pasar por
+# add_vline (que valida y construye el shape en cada llamada)
+_CENTER_LINE = {
+    "type": "line", "xref": "x", "yref": "paper",
+    "x0": 0, "x1": 0, "y0": 0, "y1": 1,
+    "line": {"width": 2, "color": "#222"},
+}
 
-    fig = go.Figure()
-
-    # --- cationes ---
-    fig.add_trace(go.Scatter(
-        x=x_cat, y=y_cat, mode="lines+markers",
-        name="Cationes", line=dict(width=3), marker=dict(size=9),
-        customdata=list(zip(cat["Ion"], meq_cat)),
-        hovertemplate="%{customdata[0]}: %{customdata[1]:.4g} meq/L<extra></extra>"
-    ))
-    # --- aniones ---
-    fig.add_trace(go.Scatter(
-        x=x_ani, y=y_ani, mode="lines+markers",
-        name="Aniones", line=dict(width=3), marker=dict(size=9),
-        customdata=list(zip(ani["Ion"], meq_ani)),
-        hovertemplate="%{customdata[0]}: %{customdata[1]:.4g} meq/L<extra></extra>"
-    ))
-
-    # línea central
-    fig.add_vline(x=0, line_width=2, line_color="#222")
-
-    # etiquetas laterales
-    y_ticks = [8,7,6,5]
-    left_labels = ["Na","Ca","Mg","Fe"]
-    right_annos = [
-        dict(xref="paper", yref="y", x=0.985, y=float(y_right[i]), text=i,
-             showarrow=False, xanchor="right", font=dict(size=12)) for i in ANI_ORDER
-    ]
-    side_titles = [
-        dict(xref="paper", yref="y", x=0.02,  y=6.5, text="<b>Cationes</b>",
-             showarrow=False, xanchor="left",  font=dict(size=14)),
-        dict(xref="paper", yref="y", x=0.985, y=6.5, text="<b>Aniones</b>",
-             showarrow=False, xanchor="right", font=dict(size=14)),
-    ]
-
-    fig.update_layout(
-        title=title, height=520, margin=dict(l=90, r=120, t=60, b=50),
-        xaxis=dict(
-            title="Concentración (meq/L) – décadas (distancia = |log10(meq)+1|)",
-            tickmode="array", tickvals=tickvals, ticktext=ticktext,
-            range=[-max_dec, max_dec], zeroline=True, zerolinewidth=2, gridcolor="#eee"
-        ),
-        yaxis=dict(
-            title="", tickmode="array", tickvals=y_ticks, ticktext=left_labels, gridcolor="#eee"
-        ),
-        hovermode="closest",
-        showlegend=False,
-        annotations=right_annos + side_titles
-    )
+# Plantilla de figura con todo lo estático ya resuelto (evaluación parcial):
+# cada replot deepcopy-a la plantilla y rellena solo los huecos dinámicos
+# (x, y, customdata, título y ticks de décadas).
+_FIG_TEMPLATE = {
+    "data": [{
+        "type": "scattergl",
+        "x": None, "y": None,
+        "mode": "lines+markers", "name": "Iones",
+        "line": {"width": 3}, "marker": {"size": 9},
+        "customdata": None,
+        "hovertemplate": "%{customdata[0]}: %{customdata[1]:.4g} meq/L<extra></extra>",
+    }],
+    "layout": {
+        "title": {"text": ""}, "height": 520,
+        "margin": {"l": 90, "r": 120, "t": 60, "b": 50},
+        "xaxis": {
+            "title": {"text": "Concentración (meq/L) – décadas (distancia = |log10(meq)+1|)"},
+            "tickmode": "array", "tickvals": None, "ticktext": None,
+            "range": None,
+            "zeroline": True, "zerolinewidth": 2, "gridcolor": "#eee",
+        },
+        "yaxis": {
+            "title": {"text": ""}, "tickmode": "array",
+            "tickvals": _Y_TICKS, "ticktext": _LEFT_LABELS, "gridcolor": "#eee",
+        },
+        "hovermode": "closest",
+        "spikedistance": 0,   # sin spike-lines: evita el barrido O(N) por mousemove
+        "showlegend": False,
+        "annotations": _ANNOTATIONS,
+        "shapes": [_CENTER_LINE],
+    },
+}
+
+# Disposición canónica 4+4 (la tabla por defecto del editor): las Y y los
+# nombres de ion del customdata son fijos, solo varían los 8 valores de meq
+_STD_IONS   = CAT_ORDER + ANI_ORDER
+_STD_GROUPS = ["cation"]*4 + ["anion"]*4
+_STD_Y = [8.0, 7.0, 6.0, 5.0, np.nan, 8.0, 7.0, 6.0, 5.0]
+_STD_CUSTOM = np.empty((9, 2), dtype=object)
+_STD_CUSTOM[:, 0] = CAT_ORDER + [""] + ANI_ORDER
+
+def _finish_layout(fig: dict, title: str, max_dec: int) -> dict:
+    """Rellena los huecos de layout que dependen del título y de max_dec."""
+    tickvals, ticktext = _tick_arrays(max_dec)
+    fig["layout"]["title"]["text"] = title
+    xaxis = fig["layout"]["xaxis"]
+    xaxis["tickvals"], xaxis["ticktext"] = tickvals, ticktext
+    xaxis["range"] = [-max_dec, max_dec]
     return fig
-    # ---- CONSTANTES ----
-    MW  = {"Na":22.989769, "Ca":40.078, "Mg":24.305, "Fe":55.845,
-       "Cl":35.453,   "HCO3":61.016, "SO4":96.06, "CO3":60.008}
-    VAL = {"Na":1, "Ca":2, "Mg":2, "Fe":2, "Cl":1, "HCO3":1, "SO4":2, "CO3":2}
 
-    FACTOR = {ion: VAL[ion]/MW[ion] for ion in MW}   # mg/L -> meq/L
+def _stiff_plot_std(meq: np.ndarray, dist: np.ndarray, pos: np.ndarray, title: str) -> dict:
+    """Especialización para la tabla canónica: sin filtrado ni reindex,
+    solo los 8 valores de meq/dist sustituidos en la plantilla."""
+    fig = copy.deepcopy(_FIG_TEMPLATE)
+    trace = fig["data"][0]
+    trace["x"] = np.concatenate([-dist[:4], [np.nan], dist[4:]]).tolist()
+    trace["y"] = list(_STD_Y)
+    customdata = _STD_CUSTOM.copy()
+    customdata[:4, 1] = meq[:4]
+    customdata[4, 1] = np.nan
+    customdata[5:, 1] = meq[4:]
+    trace["customdata"] = customdata
+    max_dec = int(np.ceil(dist[pos].max())) if pos.any() else 1
+    return _finish_layout(fig, title, max_dec)
+
+_LOG10_2 = np.float64(0.30102999566398114)   # log10(2)
+
+def _fast_log10(x, out=None, where=True):
+    """log10 vía log2*const: log2 es más barato en libm y la escala del eje
+    solo consume 3-4 cifras significativas."""
+    out = np.log2(x, out=out, where=where)
+    np.multiply(out, _LOG10_2, out=out, where=where)
+    return out
+
+def _log_dist(meq: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    """Distancia al centro: |log10(meq)+1| donde pos (meq>0), 0 en otro caso.
+
+    Una sola pasada con ufuncs in-place sobre un único buffer,
+    sin temporales intermedios (y sin evaluar log10 en ceros).
+    """
+    out = np.zeros(meq.shape, dtype=np.float64)
+    _fast_log10(meq, out=out, where=pos)
+    np.add(out, 1.0, out=out, where=pos)
+    np.abs(out, out=out)
+    return out
+
+def _side_coords(df: pd.DataFrame, group: str, order: list, y_map: dict, sign: float):
+    """Kernel de coordenadas de un lado: del frame a arrays en una pasada.
+
+    Devuelve (ions, meq, dist, pos, x, y) con X = sign*|log10(meq)+1|
+    (centro 0, 0.1 meq/L pegado al centro; dist/pos ya vienen de normalize).
+    """
+    side = df[(df["Group"] == group) & (df["Ion"].isin(order))]
+    # el editor permite filas libres: si un ion viene repetido, gana la
+    # última fila (reindex no acepta etiquetas duplicadas)
+    if side["Ion"].duplicated().any():
+        side = side.drop_duplicates("Ion", keep="last")
+    # reorden posicional vía reindex: O(n), sin Categorical ni sort
+    side = side.set_index("Ion").reindex(order).dropna(subset=["meqL"])
+    ions = side.index.to_numpy()
+    meq  = side["meqL"].to_numpy(dtype=np.float64)
+    dist = side["dist"].to_numpy(dtype=np.float64)
+    pos  = side["pos"].to_numpy(dtype=bool)
+    y = np.array([y_map[i] for i in ions], dtype=np.float64)
+    return ions, meq, dist, pos, sign * dist, y
+
+@st.cache_data(show_spinner=False)
+def stiff_plot(df: pd.DataFrame, title: str) -> dict:
+    """Devuelve la figura como dict (más barato de hashear/cachear que go.Figure)."""
+    # --- camino rápido: tabla canónica 4+4 completa y en orden estándar ---
+    if (len(df) == 8 and df["Ion"].tolist() == _STD_IONS
+            and df["Group"].tolist() == _STD_GROUPS):
+        meq = df["meqL"].to_numpy(dtype=np.float64)
+        if not np.isnan(meq).any():
+            return _stiff_plot_std(meq, df["dist"].to_numpy(dtype=np.float64),
+                                   df["pos"].to_numpy(dtype=bool), title)
+
+    # --- camino general (filas extra/faltantes): kernel por lado ---
+    ions_cat, meq_cat, dist_cat, pos_cat, x_cat, y_cat = _side_coords(df, "cation", CAT_ORDER, _Y_LEFT, -1.0)
+    ions_ani, meq_ani, dist_ani, pos_ani, x_ani, y_ani = _side_coords(df, "anion",  ANI_ORDER, _Y_RIGHT, 1.0)
+
+    # ---- rango dinámico en décadas coherente con esta escala: una sola
+    # reducción sobre las distancias ya calculadas, sin pasar por pandas ----
+    all_dist = np.concatenate([dist_cat, dist_ani])
+    pos = np.concatenate([pos_cat, pos_ani])
+    max_dec = int(np.ceil(all_dist[pos].max())) if pos.any() else 1
+
+    # --- cationes + aniones en una sola traza (NaN corta la línea) ---
+    x_line = np.concatenate([x_cat, [np.nan], x_ani])
+    y_line = np.concatenate([y_cat, [np.nan], y_ani])
+    # customdata como array 2-D contiguo (object por los nombres de ion):
+    # el encoder JSON de plotly toma el camino rápido para ndarrays
+    customdata = np.concatenate([
+        np.column_stack([ions_cat.astype(object), meq_cat]),
+        np.array([["", np.nan]], dtype=object),
+        np.column_stack([ions_ani.astype(object), meq_ani]),
+    ])
+
+    # figura como dict plano sobre la plantilla: st.plotly_chart lo acepta
+    # directo, sin pasar por los validadores de graph_objs
+    fig = copy.deepcopy(_FIG_TEMPLATE)
+    trace = fig["data"][0]
+    trace["x"] = x_line.tolist()
+    trace["y"] = y_line.tolist()
+    trace["customdata"] = customdata
+    return _finish_layout(fig, title, max_dec)
 
 
 # =====================  UI mínima  =====================
@@ -156,18 +270,21 @@ df_default = pd.DataFrame({
     "Group": ["cation","cation","cation","cation","anion","anion","anion","anion"],
     "Conc":  [27713.0, 2600.0, 510.0, 2.0, 48521.0, 854.0, 60.0, 0.0]   # ejemplo en mg/L
 })
-df_edit = st.data_editor(df_default, use_container_width=True, num_rows="dynamic",
-                         column_config={"Conc": st.column_config.NumberColumn("Conc", help="Concentración (mg/L o meq/L, segun selección)",
-                                                                             min_value=0.0, step=0.01, format="%4f"),
-                                                                             "Group": st.column_config.SelectboxColumn(
-                                                                                 "Group", options=["cation","anion"]),
-                         },
-                                                                             )
+df_edit = st.data_editor(
+    df_default, use_container_width=True, num_rows="dynamic",
+    column_config={
+        "Conc": st.column_config.NumberColumn(
+            "Conc", help="Concentración (mg/L o meq/L, segun selección)",
+            min_value=0.0, step=0.01, format="%4f"),
+        "Group": st.column_config.SelectboxColumn(
+            "Group", options=["cation","anion"]),
+    },
+)
 
 st.subheader("2) Graficar")
 if st.button("Graficar Mariposa"):
     dfN = normalize(df_edit, unit)                           # <-- ahora sí existe
-    st.dataframe(dfN[["Ion","Group","meqL"]], use_container_width=True)
+    st.dataframe(dfN[["Ion","Group","meqL","dist"]], use_container_width=True)
     st.plotly_chart(stiff_plot(dfN, "Mariposa — muestra"), use_container_width=True)
 else:
     st.info("Elige la unidad correcta, edita la tabla y pulsa **Graficar Mariposa**.")